@@ -1,8 +1,11 @@
+import os
+
 import numpy as np
 import torch
 import torchvision
 from PIL import Image
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Sampler
+from torchvision.io import ImageReadMode, read_image
 
 
 class WebDataset(torchvision.datasets.VisionDataset):
@@ -17,6 +20,7 @@ class WebDataset(torchvision.datasets.VisionDataset):
         context_size,
         use_additional_feats=False,
         sampling_fraction=1,
+        img_cache_dir=None,
     ):
         """
         Args:
@@ -31,6 +35,8 @@ class WebDataset(torchvision.datasets.VisionDataset):
             sampling_fraction: randomly sample this many (float between 0 and 1) fraction of background boxes (class 0) while training (default: 1 --> no sampling, take all)
                 All samples of class > 0 are always taken, relative ordering of bboxes is preserved
                 NOTE: For val and test data, sampling_fraction SHOULD be 1 (no sampling)
+            img_cache_dir: if not None, decoded images are cached here as uint8 .npy files on first access (default: None)
+                Subsequent epochs load raw pixels from the cache instead of decoding PNGs again
         """
         super(WebDataset, self).__init__(root)
         assert context_size >= 0
@@ -38,38 +44,30 @@ class WebDataset(torchvision.datasets.VisionDataset):
 
         self.ids = img_ids
         self.context_size = context_size
-        self.img_transform = torchvision.transforms.Compose(
-            [
-                torchvision.transforms.ToTensor(),
-            ]
-        )
 
         self.sampling_fraction = sampling_fraction
+        # created on first use in each DataLoader worker, see __getitem__
+        self.rng = None
+
+        self.img_cache_dir = img_cache_dir
+        if self.img_cache_dir is not None:
+            os.makedirs(self.img_cache_dir, exist_ok=True)
 
         self.imgs_paths = [
             "%s/imgs/%s.png" % (self.root, img_id) for img_id in self.ids
         ]
-        self.all_bboxes = [
-            np.loadtxt(
-                "%s/bboxes/%s.csv" % (self.root, img_id),
-                delimiter=",",
-                skiprows=1,
-                dtype="float32",
-            )
-            for img_id in self.ids
-        ]
+        self.all_bboxes = self._load_arrays("bboxes")
+        # split labels and convert bboxes from [x,y,w,h] to [x1,y1,x2,y2] once instead of on every __getitem__
+        self.all_labels = [bboxes[:, -1].astype(np.int64) for bboxes in self.all_bboxes]
+        for i, bboxes in enumerate(self.all_bboxes):
+            bboxes = np.ascontiguousarray(bboxes[:, :-1])
+            bboxes[:, 2:] += bboxes[:, :2]
+            self.all_bboxes[i] = bboxes
 
         if use_additional_feats:
             self.all_additional_tensor_features = [
-                torch.Tensor(
-                    np.loadtxt(
-                        "%s/additional_features/%s.csv" % (self.root, img_id),
-                        delimiter=",",
-                        skiprows=1,
-                        dtype="float32",
-                    )
-                )
-                for img_id in self.ids
+                torch.from_numpy(feats)
+                for feats in self._load_arrays("additional_features")
             ]
         else:
             self.all_additional_tensor_features = [
@@ -93,39 +91,50 @@ class WebDataset(torchvision.datasets.VisionDataset):
         """
         img_id = self.ids[index]
 
-        img = Image.open(self.imgs_paths[index]).convert("RGB")
-        img = self.img_transform(img)
+        img = self._load_img(index)  # uint8 [3,H,W]
+        img = img.float().div_(255.0)  # same scaling as transforms.ToTensor()
 
         bboxes = self.all_bboxes[index]
+        labels = self.all_labels[index]
         additional_feats = self.all_additional_tensor_features[index]
         if self.sampling_fraction < 1:  # preserve order, include all non-BG bboxes
-            sampled_bbox_idxs = np.random.permutation(bboxes.shape[0])[
-                : int(self.sampling_fraction * bboxes.shape[0])
-            ]
-            indices = np.concatenate(
-                (np.where(bboxes[:, -1] != 0)[0], sampled_bbox_idxs)
+            # torch seeds every worker differently (and reproducibly)
+            if self.rng is None:
+                self.rng = np.random.default_rng(torch.initial_seed())
+            sampled_bbox_idxs = self.rng.choice(
+                bboxes.shape[0],
+                int(self.sampling_fraction * bboxes.shape[0]),
+                replace=False,
             )
+            indices = np.concatenate((np.where(labels != 0)[0], sampled_bbox_idxs))
             indices = np.unique(indices)  # sort and remove duplicate non-BG boxes
             bboxes = bboxes[indices]
+            labels = labels[indices]
             additional_feats = additional_feats[indices]
 
-        labels = torch.LongTensor(bboxes[:, -1])
-
-        bboxes = torch.Tensor(bboxes[:, :-1])
-        bboxes[:, 2:] += bboxes[:, :2]  # convert from [x,y,w,h] to [x1,y1,x2,y2]
+        # zero-copy, already float32 [x1,y1,x2,y2] bboxes and int64 labels
+        bboxes = torch.from_numpy(bboxes)
+        labels = torch.from_numpy(labels)
 
         if (
             self.context_size > 0
         ):  # Neighborhood consists of `context_size` elements on both sides in preorder traversal
-            context_indices = []
-            for i in range(bboxes.shape[0]):
-                context = list(range(max(0, i - self.context_size), i)) + list(
-                    range(i + 1, min(bboxes.shape[0], i + self.context_size + 1))
-                )
-                context_indices.append(
-                    context + [-1] * (2 * self.context_size - len(context))
+            n_bboxes = bboxes.shape[0]
+            offsets = np.concatenate(
+                (
+                    np.arange(-self.context_size, 0),
+                    np.arange(1, self.context_size + 1),
                 )
-            context_indices = torch.LongTensor(context_indices)
+            )
+            context_indices = np.arange(n_bboxes).reshape(-1, 1) + offsets
+            invalid = (context_indices < 0) | (context_indices >= n_bboxes)
+            # move valid contexts to the front of each row (keeping their order) and set the rest to -1
+            order = np.argsort(invalid, axis=1, kind="stable")
+            context_indices = np.take_along_axis(context_indices, order, axis=1)
+            context_indices[np.take_along_axis(invalid, order, axis=1)] = -1
+            context_indices = torch.from_numpy(
+                context_indices.astype(np.int64, copy=False)
+            )
         else:
             context_indices = torch.empty((0, 0), dtype=torch.long)
 
@@ -134,10 +143,98 @@ class WebDataset(torchvision.datasets.VisionDataset):
     def __len__(self):
         return len(self.ids)
 
+    def _load_arrays(self, name):
+        """
+        Returns list of float32 np.array (one per img in `self.ids`) read from `root`/`name`.npz if it exists (see pack_data.py)
+        Otherwise falls back to parsing each `root`/`name`/<img_id>.csv file
+        """
+        packed_file = "%s/%s.npz" % (self.root, name)
+        if os.path.isfile(packed_file):
+            with np.load(packed_file) as packed:
+                return [packed[img_id] for img_id in self.ids]
+
+        return [
+            np.loadtxt(
+                "%s/%s/%s.csv" % (self.root, name, img_id),
+                delimiter=",",
+                skiprows=1,
+                dtype="float32",
+            )
+            for img_id in self.ids
+        ]
+
+    def _load_img(self, index):
+        """
+        Returns img at `index` as uint8 torch.Tensor of size [3,H,W]
+        If `img_cache_dir` is set, the decoded img is read from (or on a miss, written to) `img_cache_dir`/<img_id>.npy
+        """
+        if self.img_cache_dir is None:
+            return read_image(self.imgs_paths[index], ImageReadMode.RGB)
+
+        cache_path = "%s/%s.npy" % (self.img_cache_dir, self.ids[index])
+        if os.path.isfile(cache_path):
+            return torch.from_numpy(np.load(cache_path))
+
+        img = read_image(self.imgs_paths[index], ImageReadMode.RGB)
+        # write to a per-process tmp file first as other workers may read the same img
+        tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            np.save(f, img.numpy())
+        os.replace(tmp_path, cache_path)
+
+        return img
+
 
 ########################## End of class `WebDataset` ##########################
 
 
+class BucketBatchSampler(Sampler):
+    """
+    Batch sampler that groups images of similar resolution (H, W) in the same batch
+    so that `custom_collate_fn` pads each batch as little as possible
+    """
+
+    def __init__(self, imgs_paths, batch_size, bucket_size=64, shuffle=True):
+        """
+        Args:
+            imgs_paths: list of paths of all images in the dataset (WebDataset.imgs_paths)
+            batch_size: max number of images in a batch
+            bucket_size: images whose H and W round to the same multiple of `bucket_size` pixels share a bucket (default: 64)
+            shuffle: shuffle images within buckets and the order of batches every epoch (default: True)
+        """
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
+        buckets = {}
+        for index, img_path in enumerate(imgs_paths):
+            with Image.open(img_path) as img:  # only the header is read, not the pixels
+                W, H = img.size
+            key = (round(H / bucket_size), round(W / bucket_size))
+            buckets.setdefault(key, []).append(index)
+        self.buckets = list(buckets.values())
+
+    def __iter__(self):
+        batches = []
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = np.random.permutation(bucket).tolist()
+            batches += [
+                bucket[i : i + self.batch_size]
+                for i in range(0, len(bucket), self.batch_size)
+            ]
+
+        if self.shuffle:
+            batches = [batches[i] for i in np.random.permutation(len(batches))]
+
+        return iter(batches)
+
+    def __len__(self):
+        return sum(
+            (len(bucket) + self.batch_size - 1) // self.batch_size
+            for bucket in self.buckets
+        )
+
+
 def custom_collate_fn(batch):
     """
     Since all images might have different number of BBoxes, to use batch_size > 1,
@@ -148,7 +245,8 @@ def custom_collate_fn(batch):
 
     Returns:
         img_ids: names of images (string) to compute imgwise (webpagewise) and domainwise (macro) Accuracies
-        images: torch.Tensor of size [batch_size, 3, img_H, img_H]
+        images: torch.Tensor of size [batch_size, 3, max_img_H, max_img_W]
+            images smaller than the largest one in the batch are zero-padded at the bottom and right
         bboxes: torch.Tensor [N, 5], N = total_n_bboxes_in_batch
             each of [batch_img_index, top_left_x, top_left_y, bottom_right_x, bottom_right_y]
         additional_feats: torch.Tensor [N, n_additional_feat]
@@ -165,17 +263,28 @@ def custom_collate_fn(batch):
     # labels = (labels_1, labels_2, ...) each element of size [n_bboxes_in_image]
 
     img_ids = np.array(img_ids)
-    images = torch.stack(images, 0)
-
-    bboxes_with_batch_index = []
-    observed_bboxes = 0
-    for i, bbox in enumerate(bboxes):
-        batch_indices = torch.Tensor([i] * bbox.shape[0]).view(-1, 1)
-        bboxes_with_batch_index.append(torch.cat((batch_indices, bbox), dim=1))
-        context_indices[i][context_indices[i] != -1] += observed_bboxes
-        observed_bboxes += bbox.shape[0]
-    bboxes_with_batch_index = torch.cat(bboxes_with_batch_index)
+    if all(img.shape == images[0].shape for img in images):
+        images = torch.stack(images, 0)
+    else:  # zero-pad to largest H, W in batch, bbox coords are unaffected
+        max_H = max(img.shape[1] for img in images)
+        max_W = max(img.shape[2] for img in images)
+        batch_images = images[0].new_zeros((len(images), 3, max_H, max_W))
+        for i, img in enumerate(images):
+            batch_images[i, :, : img.shape[1], : img.shape[2]] = img
+        images = batch_images
+
+    n_bboxes = torch.tensor([bbox.shape[0] for bbox in bboxes])
+    batch_indices = torch.repeat_interleave(
+        torch.arange(len(bboxes), dtype=torch.float32), n_bboxes
+    ).view(-1, 1)
+    bboxes_with_batch_index = torch.cat((batch_indices, torch.cat(bboxes)), dim=1)
+
     context_indices = torch.cat(context_indices)
+    if context_indices.numel() > 0:  # shift contexts of each img by n_bboxes before it
+        offsets = torch.repeat_interleave(
+            torch.cumsum(n_bboxes, 0) - n_bboxes, n_bboxes
+        )
+        context_indices += offsets.view(-1, 1) * (context_indices != -1)
 
     additional_feats = torch.cat(additional_feats)
     labels = torch.cat(labels)
@@ -199,7 +308,10 @@ def load_data(
     batch_size,
     use_additional_feats=False,
     sampling_fraction=1,
-    num_workers=4,
+    num_workers=min(os.cpu_count() or 4, 8),
+    img_cache_dir=None,
+    prefetch_factor=2,
+    bucket_by_size=False,
 ):
     """
     Args:
@@ -213,47 +325,82 @@ def load_data(
             if True, `root` directory must contain additional_feats/*.csv
         sampling_fraction: randomly sample this many fraction of background boxes (class 0) while training (default: 1 --> no sampling, take all)
             All samples of class > 0 are always taken, relative ordering of bboxes is preserved
+        num_workers: number of subprocesses used for data loading (default: number of CPUs, at most 8)
+            workers are kept alive across epochs
+        img_cache_dir: directory to cache decoded images as uint8 .npy files (default: None --> no caching)
+        prefetch_factor: number of batches loaded in advance by each worker (default: 2)
+        bucket_by_size: batch train imgs of similar resolution together using BucketBatchSampler (default: False)
+            only useful if imgs differ in size, otherwise all of them fall in one bucket
 
     Returns:
         train_loader, val_loader, test_loader (torch.utils.data.DataLoader)
     """
-    assert np.intersect1d(train_img_ids, val_img_ids).size == 0
-    assert np.intersect1d(val_img_ids, test_img_ids).size == 0
-    assert np.intersect1d(train_img_ids, test_img_ids).size == 0
+    train_img_id_set = frozenset(train_img_ids)
+    assert train_img_id_set.isdisjoint(val_img_ids)
+    assert frozenset(val_img_ids).isdisjoint(test_img_ids)
+    assert train_img_id_set.isdisjoint(test_img_ids)
 
     train_dataset = WebDataset(
-        data_dir, train_img_ids, context_size, use_additional_feats, sampling_fraction
+        data_dir,
+        train_img_ids,
+        context_size,
+        use_additional_feats,
+        sampling_fraction,
+        img_cache_dir,
     )
+    if bucket_by_size:
+        batching = dict(
+            batch_sampler=BucketBatchSampler(train_dataset.imgs_paths, batch_size)
+        )
+    else:
+        batching = dict(batch_size=batch_size, shuffle=True, drop_last=False)
     train_loader = DataLoader(
         train_dataset,
-        batch_size=batch_size,
-        shuffle=True,
         num_workers=num_workers,
+        prefetch_factor=prefetch_factor,
+        persistent_workers=num_workers > 0,
         collate_fn=custom_collate_fn,
-        drop_last=False,
+        pin_memory=True,
+        **batching,
     )
 
     val_dataset = WebDataset(
-        data_dir, val_img_ids, context_size, use_additional_feats, sampling_fraction=1
+        data_dir,
+        val_img_ids,
+        context_size,
+        use_additional_feats,
+        sampling_fraction=1,
+        img_cache_dir=img_cache_dir,
     )
     val_loader = DataLoader(
         val_dataset,
         batch_size=10,
         shuffle=False,
         num_workers=num_workers,
+        prefetch_factor=prefetch_factor,
+        persistent_workers=num_workers > 0,
         collate_fn=custom_collate_fn,
+        pin_memory=True,
         drop_last=False,
     )
 
     test_dataset = WebDataset(
-        data_dir, test_img_ids, context_size, use_additional_feats, sampling_fraction=1
+        data_dir,
+        test_img_ids,
+        context_size,
+        use_additional_feats,
+        sampling_fraction=1,
+        img_cache_dir=img_cache_dir,
     )
     test_loader = DataLoader(
         test_dataset,
         batch_size=10,
         shuffle=False,
         num_workers=num_workers,
+        prefetch_factor=prefetch_factor,
+        persistent_workers=num_workers > 0,
         collate_fn=custom_collate_fn,
+        pin_memory=True,
         drop_last=False,
     )
 
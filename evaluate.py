@@ -92,6 +92,8 @@ if __name__ == "__main__":
     device = torch.device(
         "cuda:%d" % args.device if torch.cuda.is_available() else "cpu"
     )
+    # same as main.py: autotune conv kernels per input shape, not deterministic
+    torch.backends.cudnn.benchmark = True
 
     N_CLASSES = Constants.N_CLASSES
     CLASS_NAMES = Constants.CLASS_NAMES
@@ -160,14 +162,21 @@ if __name__ == "__main__":
 
     ########## TEST DATA LOADER ##########
     test_dataset = WebDataset(
-        DATA_DIR, test_img_ids, CONTEXT_SIZE, USE_ADDITIONAL_FEAT, sampling_fraction=1
+        DATA_DIR,
+        test_img_ids,
+        CONTEXT_SIZE,
+        USE_ADDITIONAL_FEAT,
+        sampling_fraction=1,
+        img_cache_dir=args.img_cache_dir,
     )
     test_loader = DataLoader(
         test_dataset,
         batch_size=10,
         shuffle=False,
-        num_workers=5,
+        num_workers=args.num_workers,
+        prefetch_factor=args.prefetch_factor,
         collate_fn=custom_collate_fn,
+        pin_memory=True,
         drop_last=False,
     )
     n_additional_feat = test_dataset.n_additional_feat
@@ -194,9 +203,31 @@ if __name__ == "__main__":
         n_additional_feat,
         DROP_PROB,
         CLASS_NAMES,
+        args.use_amp,
     ).to(device)
     model.load_state_dict(torch.load(model_save_file, map_location=device))
 
+    # quantized convnet only runs on CPU, calibrate it on a fixed subset of val imgs
+    if args.quantize_int8:
+        device = torch.device("cpu")
+        model = model.to(device)
+        val_img_ids = np.loadtxt("%s/val_imgs.txt" % FOLD_DIR, str)
+        calibration_dataset = WebDataset(
+            DATA_DIR,
+            np.random.default_rng(Constants.SEED).permutation(val_img_ids)[:50],
+            CONTEXT_SIZE,
+            USE_ADDITIONAL_FEAT,
+            sampling_fraction=1,
+            img_cache_dir=args.img_cache_dir,
+        )
+        calibration_loader = DataLoader(
+            calibration_dataset,
+            batch_size=10,
+            shuffle=False,
+            collate_fn=custom_collate_fn,
+        )
+        model.quantize_convnet(calibration_loader)
+
     evaluate(
         model,
         test_loader,
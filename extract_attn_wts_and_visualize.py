@@ -114,10 +114,7 @@ for index, img_id in tqdm(enumerate(test_img_ids), total=len(test_img_ids)):
             N, -1
         )  # [N, 2 * context_size * 4]
 
-        visual_feats = model._get_visual_features(images, bboxes)
-        bbox_feats = model._get_bbox_features(bboxes)
-        additional_feats = model.bn_additional_feat(additional_feats)
-        own_features = torch.cat((visual_feats, bbox_feats, additional_feats), dim=1)
+        own_features = model._get_own_features(images, bboxes, additional_feats)
 
         _, attention_wts = model.gat(
             own_features, context_indices, return_attn_wts=True
@@ -16,6 +16,9 @@ args = parser.parse_args()
 
 device = torch.device("cuda:%d" % args.device if torch.cuda.is_available() else "cpu")
 set_all_seeds(Constants.SEED)
+# cuDNN autotunes conv kernels once per distinct input shape (H x W, batch size)
+# faster than its default heuristics, at the cost of run-to-run determinism
+torch.backends.cudnn.benchmark = True
 
 N_CLASSES = Constants.N_CLASSES
 CLASS_NAMES = Constants.CLASS_NAMES
@@ -98,6 +101,9 @@ train_loader, val_loader, test_loader = load_data(
     USE_ADDITIONAL_FEAT,
     SAMPLING_FRACTION,
     NUM_WORKERS,
+    args.img_cache_dir,
+    args.prefetch_factor,
+    args.bucket_by_size,
 )
 n_additional_feat = train_loader.dataset.n_additional_feat
 
@@ -116,6 +122,7 @@ print_and_log("BBox Hidden Dim: %d" % (BBOX_HIDDEN_DIM), log_file)
 print_and_log("Use Additional Features: %s" % (USE_ADDITIONAL_FEAT), log_file)
 print_and_log("Weight Decay: %.0e" % (WEIGHT_DECAY), log_file)
 print_and_log("Dropout Probability: %.2f" % (DROP_PROB), log_file)
+print_and_log("Mixed Precision: %s" % (args.use_amp), log_file)
 print_and_log("Sampling Fraction: %.2f\n" % (SAMPLING_FRACTION), log_file)
 
 ########## TRAIN MODEL ##########
@@ -129,6 +136,7 @@ model = CoVA(
     n_additional_feat,
     DROP_PROB,
     CLASS_NAMES,
+    args.use_amp,
 ).to(device)
 optimizer = torch.optim.Adam(
     model.parameters(), lr=LEARNING_RATE, weight_decay=WEIGHT_DECAY
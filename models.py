@@ -18,6 +18,7 @@ class CoVA(nn.Module):
         n_additional_feat=0,
         drop_prob=0.2,
         class_names=None,
+        use_amp=False,
     ):
         """
         Implementation of CoVA: Context-aware Visual Attention for Webpage Information Extraction
@@ -31,6 +32,7 @@ class CoVA(nn.Module):
         n_additional_feat: num of additional features for each bbox to be used along with visual and bbox features
         drop_prob: dropout probability (default: 0.2)
         class_names: list of n_classes string elements containing names of the classes (default: [0, 1, ..., n_classes-1])
+        use_amp: if True, run the convnet and roi_pool in mixed precision (FP16) on CUDA (default: False)
         """
         super(CoVA, self).__init__()
 
@@ -39,6 +41,7 @@ class CoVA(nn.Module):
         self.hidden_dim = hidden_dim
         self.bbox_hidden_dim = bbox_hidden_dim
         self.n_additional_feat = n_additional_feat
+        self.use_amp = use_amp
         self.class_names = (
             np.arange(self.n_classes).astype(str)
             if class_names is None
@@ -56,6 +59,9 @@ class CoVA(nn.Module):
         spatial_scale = _convnet_output_size[2] / img_H
 
         self.roi_pool = torchvision.ops.RoIPool(roi_output_size, spatial_scale)
+        self.convnet = self.convnet.to(
+            memory_format=torch.channels_last
+        )  # NHWC lets cuDNN pick faster (tensor core) conv kernels
 
         self.n_visual_feat = (
             _convnet_output_size[1] * roi_output_size[0] * roi_output_size[1]
@@ -104,10 +110,7 @@ class CoVA(nn.Module):
             prediction_scores: torch.Tensor of size [N, n_classes]
         """
         ##### OWN VISUAL + BBOX FEATURES + ADDITIONAL FEATURES #####
-        visual_feats = self._get_visual_features(images, bboxes)
-        bbox_feats = self._get_bbox_features(bboxes)
-        additional_feats = self.bn_additional_feat(additional_feats)
-        own_features = torch.cat((visual_feats, bbox_feats, additional_feats), dim=1)
+        own_features = self._get_own_features(images, bboxes, additional_feats)
 
         ##### CONTEXT FEATURES USING GRAPH ATTENTION LAYER #####
         if self.use_context:
@@ -121,31 +124,63 @@ class CoVA(nn.Module):
 
         return output
 
+    @torch.no_grad()
+    def quantize_convnet(self, calibration_loader, n_calibration_batches=5):
+        """
+        Post-training static INT8 quantization of the convnet, for inference only (quantized ops run on CPU)
+        Activation ranges are calibrated on first `n_calibration_batches` batches of `calibration_loader`
+        Model must already be on CPU and have its trained weights loaded. RoIPool and everything after it stays FP32
+        """
+        from torch.quantization import get_default_qconfig
+        from torch.quantization.quantize_fx import convert_fx, prepare_fx
+
+        self.eval()
+        self.use_amp = False  # autocast is CUDA only
+        convnet = prepare_fx(self.convnet, {"": get_default_qconfig("fbgemm")})
+        for i, (_, images, _, _, _, _) in enumerate(calibration_loader):
+            if i == n_calibration_batches:
+                break
+            convnet(images.contiguous(memory_format=torch.channels_last))
+        self.convnet = convert_fx(convnet)  # output is dequantized back to FP32
+
+    def _get_own_features(self, images, bboxes, additional_feats):
+        """
+        Get [visual_feats, bbox_feats, additional_feats] of size [N, n_feat] for each bbox
+        Disabled (zero-sized) feature groups are skipped instead of being concatenated
+        """
+        feats = [self._get_visual_features(images, bboxes)]
+        if self.bbox_hidden_dim > 0:
+            feats.append(self._get_bbox_features(bboxes))
+        if self.n_additional_feat > 0:
+            feats.append(self.bn_additional_feat(additional_feats))
+
+        if len(feats) == 1:  # only visual features, avoid copying them
+            return feats[0]
+        return torch.cat(feats, dim=1)
+
     def _get_visual_features(self, images, bboxes):
-        return self.roi_pool(self.convnet(images), bboxes).view(
-            bboxes.shape[0], self.n_visual_feat
+        images = images.contiguous(memory_format=torch.channels_last)
+        with torch.cuda.amp.autocast(enabled=self.use_amp):
+            # only the conv trunk runs in NHWC; roi_pool needs NCHW (it would call
+            # .contiguous() internally anyway), so convert explicitly here
+            conv_feats = self.convnet(images).contiguous()
+            visual_feats = self.roi_pool(conv_feats, bboxes)
+
+        # rest of the network (bbox features, GAT, decoder) stays in FP32
+        return (
+            visual_feats.float().contiguous().view(bboxes.shape[0], self.n_visual_feat)
         )
 
     def _get_bbox_features(self, bboxes):
         """
-        Get [x,y,w,h,asp_ratio] for each bbox and transform to n_bbox_feat if bbox fetaures are to be used
+        Get [x,y,w,h,asp_ratio] for each bbox and transform to n_bbox_feat
+        Only used when bbox_hidden_dim > 0 (see _get_own_features)
         """
-        if self.bbox_hidden_dim > 0:
-            bbox_feats = bboxes[:, 1:].clone()  # discard batch_img_index column
-            bbox_feats[:, 2:] -= bbox_feats[
-                :, :2
-            ]  # convert to [top_left_x, top_left_y, width, height]
+        x1, y1, x2, y2 = bboxes[:, 1:].unbind(1)  # discard batch_img_index column
+        w, h = x2 - x1, y2 - y1
+        bbox_feats = torch.stack((x1, y1, w, h, w / h), dim=1)  # [N, 5]
 
-            bbox_asp_ratio = (bbox_feats[:, 2] / bbox_feats[:, 3]).view(
-                bboxes.shape[0], 1
-            )
-            bbox_feats = torch.cat((bbox_feats, bbox_asp_ratio), dim=1)
-
-            bbox_feats = self.bbox_feat_encoder(bbox_feats)
-        else:
-            bbox_feats = bboxes[:, :0]  # size [n_bboxes, 0]
-
-        return bbox_feats
+        return self.bbox_feat_encoder(bbox_feats)
 
 
 class GraphAttentionLayer(nn.Module):
@@ -175,32 +210,24 @@ class GraphAttentionLayer(nn.Module):
             ids (0 to N-1) of `n_context` bboxes that are in context (neighborhood) for a given bbox.
             If not enough found, rest are -1
         """
-        N, n_context = context_indices.shape
-
-        zero_feat = torch.zeros((1, self.in_features)).to(
-            h_i.device
-        )  # to map -1 contexts to zero_feat
-        h_i_padded = torch.cat((h_i, zero_feat), dim=0)
-        h_j = h_i_padded[context_indices.view(-1)].view(
-            N, n_context, self.in_features
-        )  # context_features
-
         Wh_i = self.W_i(h_i)  # [N, hidden_dim]
-        Wh_i_repeated = Wh_i.repeat_interleave(n_context, dim=0).view(
-            N, n_context, self.hidden_dim
-        )
-
-        Wh_j = self.W_j(h_j)  # [N, n_context, hidden_dim]
-
-        attention_wts = self.attention_layer(
-            torch.cat((Wh_i_repeated, Wh_j), dim=2)
-        ).squeeze(
-            2
-        )  # [N, n_context]
-        attention_wts = self.leakyrelu(attention_wts)
 
-        minus_inf = -9e15 * torch.ones_like(attention_wts)
-        attention_wts = torch.where(context_indices >= 0, attention_wts, minus_inf)
+        # W_j has no bias, so project every bbox once and gather the projected contexts
+        # instead of gathering [N, n_context, in_features] features; -1 contexts map to zeros as before
+        context_mask = (context_indices >= 0).unsqueeze(2)  # [N, n_context, 1]
+        Wh_j = (
+            self.W_j(h_i)[context_indices.clamp(min=0)] * context_mask
+        )  # [N, n_context, hidden_dim]
+
+        # attention_layer([Wh_i, Wh_j]) == a_i.Wh_i + a_j.Wh_j + bias, so apply both halves of its weight
+        # separately and broadcast instead of building the [N, n_context, 2*hidden_dim] concatenation
+        a_i, a_j = self.attention_layer.weight.split(self.hidden_dim, dim=1)
+        e_i = nn.functional.linear(Wh_i, a_i, self.attention_layer.bias)  # [N, 1]
+        e_j = nn.functional.linear(Wh_j, a_j).squeeze(2)  # [N, n_context]
+        attention_wts = self.leakyrelu(e_i + e_j)  # [N, n_context]
+
+        # large finite value instead of -inf so that bboxes without any context get uniform weights, not NaNs
+        attention_wts = attention_wts.masked_fill(context_indices < 0, -9e15)
         attention_wts = torch.softmax(attention_wts, dim=1)  # [N, n_context]
 
         h_prime = (attention_wts.unsqueeze(-1) * Wh_j).sum(
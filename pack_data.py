@@ -0,0 +1,37 @@
+"""
+One-time conversion of per-image bboxes/*.csv (and additional_features/*.csv if present) in DATA_DIR
+to a single bboxes.npz (and additional_features.npz) keyed by img_id.
+WebDataset picks these up automatically, avoiding parsing thousands of csv files every time data is loaded.
+"""
+
+import os
+import sys
+
+import numpy as np
+from tqdm import tqdm
+
+from constants import Constants
+
+assert len(sys.argv) == 1, "Usage: python3 pack_data.py"
+
+DATA_DIR = Constants.DATA_DIR
+SPLIT_DIR = Constants.SPLIT_DIR
+
+img_ids = np.loadtxt("%s/all_imgs.txt" % SPLIT_DIR, str)
+
+for name in ["bboxes", "additional_features"]:
+    if not os.path.isdir("%s/%s" % (DATA_DIR, name)):
+        print('"%s/%s" not found, skipping' % (DATA_DIR, name))
+        continue
+
+    arrays = {
+        img_id: np.loadtxt(
+            "%s/%s/%s.csv" % (DATA_DIR, name, img_id),
+            delimiter=",",
+            skiprows=1,
+            dtype="float32",
+        )
+        for img_id in tqdm(img_ids, desc=name)
+    }
+    np.savez("%s/%s.npz" % (DATA_DIR, name), **arrays)
+    print('Packed %d files into "%s/%s.npz"' % (len(arrays), DATA_DIR, name))
@@ -26,6 +26,9 @@ def train_model(
     print("Training Model for %d epochs..." % (n_epochs))
     model.train()
 
+    scaler = torch.cuda.amp.GradScaler(
+        enabled=model.use_amp
+    )  # no-op unless model runs in mixed precision
     best_eval_acc = 0.0
     patience = 7  # number of VAL Acc values observed after best value to stop training
     for epoch in range(1, n_epochs + 1):
@@ -39,16 +42,16 @@ def train_model(
             context_indices,
             labels,
         ) in train_loader:
-            labels = labels.to(device)  # [total_n_bboxes_in_batch]
+            labels = labels.to(device, non_blocking=True)  # [total_n_bboxes_in_batch]
             n_bboxes += labels.shape[0]
 
             optimizer.zero_grad()
 
             output = model(
-                images.to(device),
-                bboxes.to(device),
-                additional_feats.to(device),
-                context_indices.to(device),
+                images.to(device, non_blocking=True),
+                bboxes.to(device, non_blocking=True),
+                additional_feats.to(device, non_blocking=True),
+                context_indices.to(device, non_blocking=True),
             )  # [total_n_bboxes_in_batch, n_classes]
             predictions = output.argmax(dim=1)  # [total_n_bboxes_in_batch]
             epoch_correct += (predictions == labels).sum().item()
@@ -56,8 +59,9 @@ def train_model(
             loss = criterion(output, labels)
             epoch_loss += loss.item()
 
-            loss.backward()
-            optimizer.step()
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
 
         print_and_log(
             "Epoch: %2d  Loss: %.4f  Accuracy: %.2f%%  (%.2fs)"
@@ -120,12 +124,12 @@ def evaluate_model(
         context_indices,
         labels,
     ) in eval_loader:
-        labels = labels.to(device)  # [total_n_bboxes_in_batch]
+        labels = labels.to(device, non_blocking=True)  # [total_n_bboxes_in_batch]
         output = model(
-            images.to(device),
-            bboxes.to(device),
-            additional_feats.to(device),
-            context_indices.to(device),
+            images.to(device, non_blocking=True),
+            bboxes.to(device, non_blocking=True),
+            additional_feats.to(device, non_blocking=True),
+            context_indices.to(device, non_blocking=True),
         )  # [total_n_bboxes_in_batch, n_classes]
 
         batch_indices = torch.unique(bboxes[:, 0]).long()
@@ -1,4 +1,5 @@
 import argparse
+import os
 import pickle
 import random
 
@@ -23,10 +24,25 @@ def cmdline_args_parser():
     parser.add_argument(
         "--use_additional_feat", dest="additional_feat", action="store_true"
     )
+    parser.add_argument(
+        "--use_amp", dest="use_amp", action="store_true"
+    )  # mixed precision (FP16) convnet, CUDA only
+    parser.add_argument(
+        "--quantize_int8", dest="quantize_int8", action="store_true"
+    )  # INT8 convnet for CPU inference, used by evaluate.py only
     parser.add_argument("-wd", "--weight_decay", type=float, default=1e-3)
     parser.add_argument("-dp", "--drop_prob", type=float, default=0.2)
     parser.add_argument("-sf", "--sampling_fraction", type=float, default=0.9)
-    parser.add_argument("-nw", "--num_workers", type=int, default=5)
+    parser.add_argument(
+        "-nw", "--num_workers", type=int, default=min(os.cpu_count() or 4, 8)
+    )
+    parser.add_argument("-pf", "--prefetch_factor", type=int, default=2)
+    parser.add_argument(
+        "--bucket_by_size", dest="bucket_by_size", action="store_true"
+    )  # batch train imgs of similar resolution together (only if imgs differ in size)
+    parser.add_argument(
+        "--img_cache_dir", type=str, default=None
+    )  # cache decoded images as uint8 .npy files here (skips PNG decoding after first epoch)
     parser.add_argument(
         "-cvf", "--cv_fold", type=int, required=True, choices=[-1, 1, 2, 3, 4, 5]
     )  # cvf=-1 means fold_dir is set to split_dir